@@ -17,8 +17,17 @@ hashing = Hashing(app)
 @manager.command
 def initdb():
     """Initializes an empty application database"""
-    from stacktracker import db
-    db.create_all()
+    from stacktracker.archive import ensure_schema
+    ensure_schema()
+
+
+@manager.command
+def archive(days=None):
+    """Move items sold more than ARCHIVE_AFTER_DAYS ago to the archive table. manage.py archive [-d days]"""
+    from stacktracker.archive import archive_sold, ensure_schema
+    ensure_schema()
+    moved = archive_sold(int(days) if days is not None else None)
+    print('Archived {} items'.format(moved))
 
 
 @manager.command
@@ -75,6 +84,58 @@ def adduser(email, password):
         print('User added')
 
 
+@manager.option('-b', '--bind', dest='bind', default=None, help='Address to bind to, e.g. 0.0.0.0:8000')
+@manager.option('-w', '--workers', dest='workers', type=int, default=None, help='Number of worker processes')
+@manager.option('-t', '--threads', dest='threads', type=int, default=None, help='Number of threads per worker')
+def serve(bind, workers, threads):
+    """Run the app under a pre-forking gunicorn server. Send SIGHUP to reload gracefully."""
+    import logging
+    from gunicorn.app.base import BaseApplication
+
+    # Flask only logs in debug mode, send warnings and errors to gunicorn's stderr
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    app.logger.addHandler(handler)
+
+    def warm(server):
+        # fetch spot quotes once in the master so workers start with them
+        from stacktracker import db
+        from stacktracker.spot import get_cache
+        with app.app_context():
+            get_cache().quotes()
+        db.engine.dispose()
+
+    def post_fork(server, worker):
+        # connections must not be shared across processes
+        from stacktracker import db
+        from stacktracker.spot import get_cache
+        db.engine.dispose()
+        # otherwise every worker would expire its inherited quotes at the same moment
+        get_cache().stagger()
+
+    class StackTrackerServer(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': bind or app.config['SERVE_BIND'],
+                'workers': workers or app.config['SERVE_WORKERS'],
+                'threads': threads or app.config['SERVE_THREADS'],
+                'worker_class': 'gthread',
+                'preload_app': True,
+                'max_requests': app.config['SERVE_MAX_REQUESTS'],
+                'max_requests_jitter': app.config['SERVE_MAX_REQUESTS_JITTER'],
+                'timeout': app.config['SERVE_TIMEOUT'],
+                'when_ready': warm,
+                'post_fork': post_fork,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    StackTrackerServer().run()
+
+
 @manager.command
 def removeuser(email):
     from stacktracker import db
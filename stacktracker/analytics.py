@@ -0,0 +1,152 @@
+"""
+Premium-over-spot statistics
+
+Premium is the price paid (or received) divided by the melt value at the time of
+the transaction, i.e. price / (coin weight * spot). Everything is computed with
+numpy over whole columns so it stays fast with millions of items.
+"""
+import numpy as np
+from sqlalchemy import and_, extract, func, select
+
+from stacktracker import db
+from stacktracker.archive import item_models
+from stacktracker.models import Coin
+
+
+GROUPS = ('coin', 'purchased_from', 'sold_to', 'metal', 'year')  # year of the purchase or sale
+SIDES = ('buy', 'sell')
+MAX_BINS = 200
+CHUNK_SIZE = 50000  # rows fetched from the cursor at a time
+
+
+def _group_codes(by, model, side):
+    """
+    Build the integer group code for one item table in SQL.
+
+    String keys are coded as the smallest id having that key, found by joining
+    against a grouped subquery, which is much cheaper than a CASE per row.
+
+    :return: A tuple (selectable, code expression, dictionary mapping codes to names
+             or None when the codes are the names)
+    """
+    source = model.__table__.join(Coin.__table__)
+    if by == 'coin':
+        return source, Coin.id, dict(db.session.query(Coin.id, Coin.name).all())
+    if by == 'year':
+        date = model.purchase_date if side == 'buy' else model.sold_date
+        return source, extract('year', date), None
+    owner = Coin if by == 'metal' else model
+    column = getattr(owner, by)
+    keys = select([column.label('name'), func.min(owner.id).label('code')]) \
+        .where(column.isnot(None)).group_by(column).alias()
+    names = {code: name for name, code in db.session.execute(select([keys.c.name, keys.c.code]))}
+    return source.join(keys, keys.c.name == column), keys.c.code, names
+
+
+def _recode(codes, names, index):
+    """Map one table's codes onto the shared name index without a per-row loop"""
+    present, inverse = np.unique(codes, return_inverse=True)
+    lookup = np.array([index[names[code]] for code in present.tolist()], dtype=np.int64)
+    return lookup[inverse]
+
+
+def load_columns(side, by, history=False):
+    """
+    Load the columns needed to compute premiums straight into numpy arrays.
+
+    Group keys are turned into integer codes by the database and rows are read
+    from the DBAPI cursor in chunks, so no ORM objects are built.
+
+    :param side: 'buy' for purchase premiums or 'sell' for sale premiums
+    :param by: One of GROUPS
+    :param history: Whether archived items should be included. Always true for sales.
+    :return: A tuple (codes, names, prices, weights, spots) where names maps each code
+             to its display name, or is None when the codes are the names
+    """
+    tables = []
+    for model in item_models(history or side == 'sell'):
+        source, code, names = _group_codes(by, model, side)
+        if side == 'buy':
+            price, spot = model.purchase_price, model.purchase_spot
+        else:
+            price, spot = model.sold_price, model.sold_spot
+        query = select([code, price, Coin.weight, spot]).select_from(source)
+        query = query.where(and_(code.isnot(None), price.isnot(None), spot.isnot(None)))
+        if side == 'sell':
+            query = query.where(model.sold == True)  # noqa: E712
+        chunks = []
+        result = db.session.execute(query)
+        rows = result.cursor.fetchmany(CHUNK_SIZE)
+        while rows:
+            chunks.append(np.array(rows, dtype=float))
+            rows = result.cursor.fetchmany(CHUNK_SIZE)
+        result.close()
+        tables.append((np.concatenate(chunks) if chunks else np.empty((0, 4)), names))
+
+    data = np.concatenate([table for table, _ in tables])
+    codes = data[:, 0].astype(np.int64)
+    names = tables[0][1]
+    if names is not None:
+        # each table has its own codes, so line them up by name
+        labels = sorted(set(name for _, table_names in tables for name in table_names.values()))
+        index = {name: i for i, name in enumerate(labels)}
+        codes = np.concatenate([_recode(table[:, 0].astype(np.int64), table_names, index)
+                                for table, table_names in tables])
+        names = dict(enumerate(labels))
+    return codes, names, data[:, 1], data[:, 2], data[:, 3]
+
+
+def _percentiles(sorted_values, starts, counts, q):
+    """Linearly interpolated percentile q (0-100) of every group in one pass"""
+    pos = (counts - 1) * (q / 100.0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    frac = pos - lo
+    low_values = sorted_values[starts + lo]
+    high_values = sorted_values[starts + hi]
+    return low_values + (high_values - low_values) * frac
+
+
+def premium_stats(codes, names, prices, weights, spots, bins=20):
+    """
+    Compute premium statistics for each group.
+
+    :param codes: Integer group code for each transaction
+    :param names: Dictionary mapping codes to display names, or None to use the codes
+    :param prices: Price of each transaction
+    :param weights: Precious metal weight (ozt) of each transaction's coin
+    :param spots: Spot price at the time of each transaction
+    :param bins: Number of histogram bins shared by every group
+    :return: A dictionary with the histogram bin edges and a list of per-group stats
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        premiums = prices / (weights * spots)
+    valid = np.isfinite(premiums)
+    codes, premiums = codes[valid], premiums[valid]
+    if not premiums.size:
+        return {'edges': [], 'groups': []}
+
+    present, groups = np.unique(codes, return_inverse=True)
+    order = np.lexsort((premiums, groups))
+    premiums, groups = premiums[order], groups[order]
+    counts = np.bincount(groups, minlength=len(present))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    means = np.bincount(groups, weights=premiums, minlength=len(present)) / counts
+    p10 = _percentiles(premiums, starts, counts, 10)
+    median = _percentiles(premiums, starts, counts, 50)
+    p90 = _percentiles(premiums, starts, counts, 90)
+
+    low, high = premiums.min(), premiums.max()
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    edges = np.linspace(low, high, bins + 1)
+    which = np.clip(np.searchsorted(edges, premiums, side='right') - 1, 0, bins - 1)
+    hist = np.bincount(groups * bins + which, minlength=len(present) * bins).reshape(len(present), bins)
+
+    ret = []
+    for i, code in enumerate(present.tolist()):
+        ret.append({'name': names[code] if names is not None else code, 'count': int(counts[i]), 'mean': float(means[i]),
+                    'median': float(median[i]), 'p10': float(p10[i]), 'p90': float(p90[i]),
+                    'histogram': hist[i].tolist()})
+    ret.sort(key=lambda group: group['mean'], reverse=True)
+    return {'edges': edges.tolist(), 'groups': ret}
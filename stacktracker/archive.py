@@ -0,0 +1,85 @@
+"""
+Moves old sold items out of the item table into the item_archive table
+
+Keeping the item table down to what is still in the stack (plus recent sales)
+means everyday queries don't have to scan sale history that grows forever.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, inspect, select
+
+from stacktracker import app, db
+from stacktracker.models import ArchivedItem, Item, in_stack_index
+
+
+BATCH_SIZE = 500  # stays under SQLite's limit on bound parameters
+
+
+def _rebuild_without_id_reuse(conn):
+    """
+    Recreate an item table made before it used AUTOINCREMENT. Without it SQLite
+    hands out the id of a deleted newest row again, which may already be archived.
+    """
+    table = Item.__table__
+    columns = ', '.join(column.name for column in table.columns)
+    conn.execute('DROP INDEX IF EXISTS {}'.format(in_stack_index.name))
+    conn.execute('ALTER TABLE item RENAME TO item_rebuild')
+    table.create(conn)
+    conn.execute('INSERT INTO item ({0}) SELECT {0} FROM item_rebuild'.format(columns))
+    conn.execute('DROP TABLE item_rebuild')
+    # never hand out an id that is already in the archive either
+    newest = conn.execute(select([func.max(ArchivedItem.__table__.c.id)])).scalar() or 0
+    updated = conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'item'", (newest,))
+    if not updated.rowcount:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('item', ?)", (newest,))
+
+
+def ensure_schema():
+    """Create the archive table and the in-stack partial index, upgrading old databases"""
+    db.create_all()
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'sqlite':
+            sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'item'").scalar()
+            if 'AUTOINCREMENT' not in sql.upper():
+                _rebuild_without_id_reuse(conn)
+        indexes = inspect(conn).get_indexes(Item.__tablename__)
+        if in_stack_index.name not in [index['name'] for index in indexes]:
+            in_stack_index.create(conn)
+
+
+def archive_sold(days=None):
+    """
+    Move items that were sold more than `days` days ago to the archive. Sold items
+    without a sold_date are judged by their purchase_date.
+
+    The ids are picked (and locked, where the database supports it) first and
+    both the copy and the delete use them, so a row that starts matching in
+    between is neither deleted unarchived nor archived twice.
+
+    :param days: Minimum age of a sale in days. Defaults to ARCHIVE_AFTER_DAYS.
+    :return: The number of items archived
+    """
+    if days is None:
+        days = app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    item = Item.__table__
+    # sales recorded without a date age out by their purchase date instead
+    sold_date = func.coalesce(item.c.sold_date, item.c.purchase_date)
+    condition = and_(item.c.sold == True, sold_date < cutoff)  # noqa: E712
+    ids = [row.id for row in db.session.execute(select([item.c.id]).where(condition).with_for_update())]
+    columns = [column.name for column in item.columns]
+    for start in range(0, len(ids), BATCH_SIZE):
+        batch = item.c.id.in_(ids[start:start + BATCH_SIZE])
+        rows = select([item.c[name] for name in columns]).where(batch)
+        db.session.execute(ArchivedItem.__table__.insert().from_select(columns, rows))
+        db.session.execute(item.delete().where(batch))
+    db.session.commit()
+    return len(ids)
+
+
+def item_models(history=False):
+    """
+    :param history: Whether archived items should be included
+    :return: The models to query for items
+    """
+    return (Item, ArchivedItem) if history else (Item,)
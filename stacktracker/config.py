@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 
 
@@ -22,3 +23,15 @@ try:
 except KeyError:
     MAILGUN_KEY = ''
 MAILGUN_DOMAIN = 'seanmckaybeck.com'
+SPOT_PROVIDER_URL = os.environ.get('SPOT_PROVIDER_URL', 'http://127.0.0.1:8001/spot')
+SPOT_PROVIDER_TIMEOUT = 5  # seconds
+SPOT_CACHE_TTL = 60  # seconds
+SPOT_MAX_AGE = 3600  # seconds, older quotes aren't used to fill in missing spot prices
+SPOT_CACHE_JITTER = 0.2  # each process expires its quotes up to 20% early so workers don't refresh together
+SERVE_BIND = os.environ.get('SERVE_BIND', '127.0.0.1:8000')
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+SERVE_THREADS = 2
+SERVE_MAX_REQUESTS = 1000  # recycle a worker after this many requests to contain memory growth
+SERVE_MAX_REQUESTS_JITTER = 100  # so workers don't all restart at once
+SERVE_TIMEOUT = 30  # seconds
+ARCHIVE_AFTER_DAYS = 365  # sold items older than this are moved to the archive table
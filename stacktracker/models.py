@@ -4,7 +4,8 @@ Contains all of the database models
 from stacktracker import db
 
 
-class Item(db.Model):
+class ItemMixin(object):
+    """Columns shared by the in-stack item table and the sold item archive, apart from coin_id"""
     id = db.Column(db.Integer, primary_key=True)
     year = db.Column(db.Integer)
     purchase_price = db.Column(db.Float, nullable=False)
@@ -18,7 +19,6 @@ class Item(db.Model):
     sold_spot = db.Column(db.Float)
     shipping_charged = db.Column(db.Float)
     shipping_cost = db.Column(db.Float)
-    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id'), nullable=False)
 
     def __init__(self, coin_id, purchase_price, purchase_date, purchased_from, purchase_spot,
                  sold=False, sold_price=None, sold_date=None, sold_to=None, sold_spot=None,
@@ -43,8 +43,27 @@ class Item(db.Model):
             self.shipping_cost = shipping_cost
 
     def __repr__(self):
-        return '<Item %d>' % self.id
-    
+        return '<%s %d>' % (self.__class__.__name__, self.id)
+
+
+class Item(ItemMixin, db.Model):
+    # ids must never be reused, archived items keep theirs
+    __table_args__ = {'sqlite_autoincrement': True}
+    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id'), nullable=False)
+
+
+# most queries only care about what is still in the stack
+in_stack_index = db.Index('ix_item_in_stack', Item.coin_id,
+                          sqlite_where=Item.sold == False,  # noqa: E712
+                          postgresql_where=Item.sold == False)  # noqa: E712
+
+
+class ArchivedItem(ItemMixin, db.Model):
+    """Sold items moved out of the item table by manage.py archive"""
+    __tablename__ = 'item_archive'
+    coin_id = db.Column(db.Integer, db.ForeignKey('coin.id'), nullable=False)
+    coin = db.relationship('Coin')
+
 
 class Coin(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -120,3 +139,16 @@ class User(db.Model):
     def is_anonymous(self):
         return False
 
+
+class SpotQuote(db.Model):
+    metal = db.Column(db.String(15), primary_key=True)
+    price = db.Column(db.Float, nullable=False)
+    updated = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, metal, price, updated):
+        self.metal = metal
+        self.price = price
+        self.updated = updated
+
+    def __repr__(self):
+        return '<SpotQuote %r>' % self.metal
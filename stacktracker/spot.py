@@ -0,0 +1,271 @@
+"""
+Spot price quotes for the precious metals tracked by the application.
+
+Quotes come from a pluggable provider and are kept in an in-process cache.
+Concurrent requests for an expired quote are coalesced so that only one
+upstream fetch runs at a time; everybody else is served the stale quote
+while the refresh happens. If the provider is down, the last quote that
+was persisted to the database is used instead.
+"""
+from datetime import datetime
+import random
+import threading
+import time
+
+import requests
+
+from stacktracker import app, db
+from stacktracker.models import SpotQuote
+
+
+METALS = ('gold', 'silver', 'platinum', 'palladium')
+
+
+class SpotProvider(object):
+    """Base class for spot quote providers"""
+
+    def fetch(self):
+        """
+        :return: A dictionary mapping each metal name to its spot price in USD/ozt
+        """
+        raise NotImplementedError
+
+
+class HTTPSpotProvider(SpotProvider):
+    """
+    Fetches spot quotes from a JSON endpoint that returns an object like
+    {"gold": 1250.1, "silver": 17.2, "platinum": 1020.0, "palladium": 610.5}.
+    Point SPOT_PROVIDER_URL at a local server to test against a fake provider.
+    """
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def __repr__(self):
+        return '<HTTPSpotProvider %r>' % self.url
+
+    def fetch(self):
+        req = requests.get(self.url, timeout=self.timeout)
+        if req.status_code != 200:
+            raise Exception('Request was not successful. Status code: {}'.format(req.status_code))
+        data = req.json()
+        return {metal: float(data[metal]) for metal in METALS if data.get(metal) is not None}
+
+
+class FakeSpotProvider(SpotProvider):
+    """
+    In-process provider for tests. Counts calls to fetch, can be slowed down
+    to widen the window for concurrent callers and can be made to fail.
+    """
+
+    def __init__(self, quotes, delay=0, fail=False):
+        self.quotes = quotes
+        self.delay = delay
+        self.fail = fail
+        self.fetches = 0
+        self.fetching = threading.Event()  # set whenever fetch is called
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        with self._lock:
+            self.fetches += 1
+        self.fetching.set()
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise Exception('Fake provider is down')
+        return dict(self.quotes)
+
+
+class SpotCache(object):
+    """
+    TTL cache in front of a SpotProvider with single-flight refreshes.
+
+    The first caller to find the cache expired becomes the one that fetches.
+    Callers arriving during that fetch get the stale quotes if there are any,
+    otherwise they wait for the fetch to finish.
+
+    Before going to the provider, quotes persisted by another process within
+    the TTL are used instead. Each process shortens its TTL by a random
+    fraction of up to `jitter` so that pre-forked workers don't all expire at
+    the same moment.
+    """
+
+    _random = random.SystemRandom()  # not shared with forked children
+
+    def __init__(self, provider, ttl=60, jitter=0):
+        self.provider = provider
+        self.ttl = ttl
+        self.jitter = jitter
+        self._ttl = self._draw_ttl()
+        self._quotes = {}
+        self._updated = None  # when the quotes were fetched from the provider, in UTC
+        self._fetched = None
+        self._force = False
+        self._lock = threading.Lock()
+        self._done = None  # event set when the in-flight fetch finishes
+
+    def _draw_ttl(self):
+        return self.ttl * (1 - self.jitter * self._random.random())
+
+    def _fresh(self):
+        return self._fetched is not None and time.time() - self._fetched < self._ttl
+
+    def snapshot(self):
+        """
+        :return: A tuple of a dictionary mapping each metal name to its current spot
+                 price and when those prices came from the provider (UTC), or None
+        """
+        with self._lock:
+            if self._fresh():
+                return dict(self._quotes), self._updated
+            if self._done is not None:
+                # somebody else is already fetching
+                if self._quotes:
+                    return dict(self._quotes), self._updated
+                done = self._done
+                leader = False
+            else:
+                done = self._done = threading.Event()
+                leader = True
+        if not leader:
+            done.wait(self.provider_timeout())
+            with self._lock:
+                return dict(self._quotes), self._updated
+        try:
+            self._refresh()
+        finally:
+            with self._lock:
+                self._done = None
+            done.set()
+        with self._lock:
+            return dict(self._quotes), self._updated
+
+    def quotes(self):
+        """
+        :return: A dictionary mapping each metal name to its current spot price
+        """
+        return self.snapshot()[0]
+
+    def get(self, metal):
+        """
+        :param metal: One of METALS
+        :return: The current spot price for the metal or None if it is unknown
+        """
+        return self.quotes().get(metal)
+
+    def invalidate(self):
+        """Make the next call fetch from the provider"""
+        with self._lock:
+            self._fetched = None
+            self._force = True
+
+    def stagger(self):
+        """Draw a new TTL, e.g. in a worker forked from a process that already has quotes"""
+        with self._lock:
+            self._ttl = self._draw_ttl()
+
+    def provider_timeout(self):
+        return getattr(self.provider, 'timeout', None)
+
+    def _refresh(self):
+        force, self._force = self._force, False
+        stored, updated = _load_persisted()
+        if not force and stored and updated is not None:
+            age = (datetime.utcnow() - updated).total_seconds()
+            if age < self._ttl:
+                # another process fetched recently
+                with self._lock:
+                    self._quotes.update(stored)
+                    self._updated = updated
+                    self._fetched = time.time() - age
+                return
+        try:
+            quotes = self.provider.fetch()
+        except Exception:
+            app.logger.exception('Failed to fetch spot quotes from %r', self.provider)
+            quotes = None
+        if quotes:
+            with self._lock:
+                self._quotes.update(quotes)
+                self._updated = datetime.utcnow()
+                self._fetched = time.time()
+                self._ttl = self._draw_ttl()
+            _persist(quotes)
+        else:
+            with self._lock:
+                if not self._quotes and stored:
+                    self._quotes.update(stored)
+                    self._updated = updated
+                # don't hammer a provider that is down, even when there is nothing to serve,
+                # but retry sooner than the TTL
+                self._ttl = self._draw_ttl()
+                self._fetched = time.time() - self._ttl / 2.0
+
+
+def _persist(quotes):
+    # use a connection of our own so the caller's session is left alone
+    table = SpotQuote.__table__
+    now = datetime.utcnow()
+    try:
+        with db.engine.begin() as conn:
+            for metal, price in quotes.items():
+                values = {'price': price, 'updated': now}
+                updated = conn.execute(table.update().where(table.c.metal == metal).values(**values))
+                if not updated.rowcount:
+                    conn.execute(table.insert().values(metal=metal, **values))
+    except Exception:
+        app.logger.exception('Failed to persist spot quotes')
+
+
+def _load_persisted():
+    """
+    :return: A tuple of the persisted quotes and when the oldest of them was updated
+    """
+    table = SpotQuote.__table__
+    try:
+        with db.engine.connect() as conn:
+            rows = conn.execute(table.select()).fetchall()
+    except Exception:
+        app.logger.exception('Failed to load persisted spot quotes')
+        return {}, None
+    return {row.metal: row.price for row in rows}, min([row.updated for row in rows] or [None])
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    :return: The process-wide SpotCache built from the app config
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                provider = HTTPSpotProvider(app.config['SPOT_PROVIDER_URL'],
+                                            timeout=app.config['SPOT_PROVIDER_TIMEOUT'])
+                _cache = SpotCache(provider, ttl=app.config['SPOT_CACHE_TTL'],
+                                   jitter=app.config['SPOT_CACHE_JITTER'])
+    return _cache
+
+
+def set_provider(provider):
+    """Swap in a different provider, e.g. a fake one for testing"""
+    global _cache
+    with _cache_lock:
+        _cache = SpotCache(provider, ttl=app.config['SPOT_CACHE_TTL'], jitter=app.config['SPOT_CACHE_JITTER'])
+
+
+def spot_price(metal, max_age=None):
+    """
+    :param metal: One of METALS
+    :param max_age: Ignore quotes that came from the provider more than this many seconds ago
+    :return: The current spot price for the metal or None if it is unknown or too old
+    """
+    quotes, updated = get_cache().snapshot()
+    if max_age is not None and (updated is None or (datetime.utcnow() - updated).total_seconds() > max_age):
+        return None
+    return quotes.get(metal)
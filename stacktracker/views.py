@@ -1,20 +1,25 @@
 """
 Contains all of the routing views
 """
+import datetime
 from functools import wraps
 import os
 import time
 
 from flask import render_template, abort, request, redirect, url_for, flash
-from flask_restful import Api, Resource, reqparse
+from flask_restful import Api, Resource, inputs, reqparse
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
 from flask.ext.hashing import Hashing
 from itsdangerous import URLSafeTimedSerializer
+from dateutil.parser import parse as parse_date
 
 from .mailgun import mailgun_notify
 from stacktracker import app, db
-from stacktracker.models import Coin, Item, User
+from stacktracker.analytics import GROUPS, MAX_BINS, SIDES, load_columns, premium_stats
+from stacktracker.archive import item_models
+from stacktracker.models import ArchivedItem, Coin, Item, User
 from stacktracker.forms import CoinForm, ItemForm, LoginForm, RegistrationForm
+from stacktracker.spot import METALS, get_cache, spot_price
 
 
 api = Api(app)
@@ -74,6 +79,29 @@ def check_admin(func):
     return decorated_function
 
 
+def find_item(item_id):
+    """Look an item up by id in the item table, then in the archive"""
+    for model in item_models(history=True):
+        item = model.query.get(item_id)
+        if item:
+            return item
+    return None
+
+
+def is_today(date):
+    """Whether a date string is today. A missing date counts as today."""
+    if not date:
+        return True
+    try:
+        return parse_date(date).date() == datetime.date.today()
+    except (ValueError, OverflowError):
+        return False
+
+
+def date_string(date):
+    return date.isoformat() if date else None
+
+
 def send_email(user, html):
     conf = {
             'api_key': app.config['MAILGUN_KEY'],
@@ -130,10 +158,11 @@ class CoinResource(Resource):
 
     def post(self):
         required_args = ['name', 'weight', 'actual_weight', 'metal', 'country']
-        for arg in self.parser.args:
+        parser = self.parser.copy()
+        for arg in parser.args:
             if arg.name in required_args:
                 arg.required = True
-        args = self.parser.parse_args()
+        args = parser.parse_args()
         stripped = {arg: args[arg] for arg in args if arg not in required_args}
         coin = Coin(args['name'], args['weight'], args['actual_weight'], args['metal'],
                     args['country'], **stripped)
@@ -142,10 +171,11 @@ class CoinResource(Resource):
         return {'message': 'Success'}, 200
 
     def put(self):
-        for arg in self.parser.args:
+        parser = self.parser.copy()
+        for arg in parser.args:
             if arg.name == 'name':
                 arg.required = True
-        args = self.parser.parse_args()
+        args = parser.parse_args()
         coin = Coin.query.filter_by(name=args['name']).first()
         if not coin:
             return {'message': 'ERROR: That coin does not exist'}, 400
@@ -187,39 +217,76 @@ class ItemResource(Resource):
     parser.add_argument('shipping_cost', type=float, help='The actual cost of shipping the item')
 
     def get(self):
-         parser = reqparse.RequestParser()
-         parser.add_argument('id', action='append', help='The id of the item being grabbed. '
-                                                           'Specify the argument multiple times '
-                                                           'to get multiple items.')
-         args = parser.parse_args()
-         if args['id']:
-             items = Item.query.filter(Item.id.in_(args['id'])).all()
-         else:
-             items = Item.query.all()
-         ret = {'items': [{} for item in items]}
-         return ret, 200
+        parser = reqparse.RequestParser()
+        parser.add_argument('id', type=int, action='append', help='The id of the item being grabbed. '
+                                                                  'Specify the argument multiple times '
+                                                                  'to get multiple items.')
+        parser.add_argument('sold', type=inputs.boolean, help='Only get sold (true) or in-stack (false) items. '
+                                                               'Asking for sold items or by id includes the archive.')
+        parser.add_argument('history', type=inputs.boolean, default=False,
+                            help='Include items that have been moved to the archive')
+        args = parser.parse_args()
+        items = []
+        # an id may belong to an archived item, and put/delete find those too
+        for model in item_models(args['history'] or args['sold'] is True or bool(args['id'])):
+            query = db.session.query(model, Coin.name).join(Coin, model.coin_id == Coin.id)
+            if args['id']:
+                query = query.filter(model.id.in_(args['id']))
+            if args['sold'] is not None:
+                query = query.filter(model.sold == args['sold'])
+            items.extend(query.all())
+        ret = {'items': [{'id': item.id, 'coin_name': coin_name, 'year': item.year,
+                          'purchase_price': item.purchase_price, 'purchase_date': date_string(item.purchase_date),
+                          'purchased_from': item.purchased_from, 'purchase_spot': item.purchase_spot,
+                          'sold': bool(item.sold), 'sold_price': item.sold_price,
+                          'sold_date': date_string(item.sold_date), 'sold_to': item.sold_to,
+                          'sold_spot': item.sold_spot, 'shipping_charged': item.shipping_charged,
+                          'shipping_cost': item.shipping_cost, 'archived': isinstance(item, ArchivedItem)}
+                         for item, coin_name in items]}
+        return ret, 200
 
     def post(self):
-        required_args = ['coin_name', 'purchase_price', 'purchase_date', 'purchased_from',
-                         'purchase_spot', 'sold']
-        for arg in self.parser.args:
+        required_args = ['coin_name', 'purchase_price', 'purchase_date', 'purchased_from', 'sold']
+        parser = self.parser.copy()
+        for arg in parser.args:
             if arg.name in required_args:
                 arg.required = True
-        args = self.parser.parse_args()
-        stripped = {arg: args[arg] for arg in args if arg not in required_args}
-        coin_id = Coin.query.filter_by(name=args['coin_name']).first().id
-        item = Item(coin_id, args['purchase_price'], args['purchase_date'], args['purchased_from'],
-                    args['purchase_spot'], args['sold'], **stripped)
+        args = parser.parse_args()
+        stripped = {arg: args[arg] for arg in args if arg not in required_args + ['id', 'purchase_spot']}
+        coin = Coin.query.filter_by(name=args['coin_name']).first()
+        if not coin:
+            return {'message': 'ERROR: That coin does not exist'}, 400
+        try:
+            purchase_date = parse_date(args['purchase_date'])
+            if args['sold_date']:
+                stripped['sold_date'] = parse_date(args['sold_date'])
+        except (ValueError, OverflowError):
+            return {'message': 'ERROR: Invalid date'}, 400
+        # the current spot is only right for transactions happening today, and only if it is recent
+        max_age = app.config['SPOT_MAX_AGE']
+        purchase_spot = args['purchase_spot']
+        if purchase_spot is None and is_today(args['purchase_date']):
+            purchase_spot = spot_price(coin.metal, max_age=max_age)
+        if purchase_spot is None:
+            return {'message': 'ERROR: No current spot price available, please specify purchase_spot'}, 400
+        if args['sold'] and args['sold_spot'] is None:
+            if is_today(args['sold_date']):
+                stripped['sold_spot'] = spot_price(coin.metal, max_age=max_age)
+            if stripped['sold_spot'] is None:
+                return {'message': 'ERROR: No current spot price available, please specify sold_spot'}, 400
+        item = Item(coin.id, args['purchase_price'], purchase_date, args['purchased_from'],
+                    purchase_spot, args['sold'], **stripped)
         db.session.add(item)
         db.session.commit()
         return {'message': 'Success'}, 200
 
     def put(self):
-        for arg in self.parser.args:
+        parser = self.parser.copy()
+        for arg in parser.args:
             if arg.name == 'id':
                 arg.required = True
-        args = self.parser.parse_args()
-        item = Item.query.filter_by(id=args['id']).first()
+        args = parser.parse_args()
+        item = find_item(args['id'])
         if not item:
             return {'message': 'ERROR: That item does not exist'}, 400
         for arg in args:
@@ -234,16 +301,50 @@ class ItemResource(Resource):
         parser = reqparse.RequestParser()
         parser.add_argument('id', type=int, help='The ID of the item being deleted')
         args = parser.parse_args()
-        item = Item.query.filter_by(id=args['id']).first()
+        item = find_item(args['id'])
         if not item:
-            return {'message': 'ERROR: Coin does not exist'}, 400
+            return {'message': 'ERROR: That item does not exist'}, 400
         db.session.delete(item)
         db.session.commit()
         return {'message': 'Success'}, 200
 
 
+class SpotResource(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('metal', action='append', choices=METALS,
+                            help='The metal to get the spot price for. Specify the argument '
+                                 'multiple times to get multiple metals.')
+        args = parser.parse_args()
+        quotes, updated = get_cache().snapshot()
+        metals = args['metal'] or METALS
+        ret = {'spot': {metal: quotes.get(metal) for metal in metals}, 'updated': date_string(updated)}
+        return ret, 200
+
+
+class PremiumResource(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('by', type=str, default='coin', choices=GROUPS,
+                            help='What to group premiums by')
+        parser.add_argument('side', type=str, default='buy', choices=SIDES,
+                            help='Premiums paid on purchases (buy) or received on sales (sell)')
+        parser.add_argument('bins', type=int, default=20, help='The number of histogram bins')
+        parser.add_argument('history', type=inputs.boolean, default=False,
+                            help='Include archived items. Sales always include them.')
+        args = parser.parse_args()
+        if not 1 <= args['bins'] <= MAX_BINS:
+            return {'message': 'ERROR: bins must be between 1 and {}'.format(MAX_BINS)}, 400
+        columns = load_columns(args['side'], args['by'], args['history'])
+        ret = premium_stats(*columns, bins=args['bins'])
+        ret.update({'by': args['by'], 'side': args['side']})
+        return ret, 200
+
+
 api.add_resource(CoinResource, '/api/coin')
 api.add_resource(ItemResource, '/api/item')
+api.add_resource(SpotResource, '/api/spot')
+api.add_resource(PremiumResource, '/api/premium')
 
 
 # ------
@@ -0,0 +1,95 @@
+from datetime import datetime
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from stacktracker import app, db
+from stacktracker.analytics import MAX_BINS, load_columns, premium_stats
+from stacktracker.models import Coin, Item
+
+
+class PremiumStatsTest(unittest.TestCase):
+    def test_matches_numpy_per_group(self):
+        rng = np.random.RandomState(0)
+        n = 10000
+        codes = rng.randint(0, 5, n)
+        prices = rng.uniform(20, 40, n)
+        weights = np.ones(n)
+        spots = rng.uniform(15, 20, n)
+        names = {code: 'group %d' % code for code in range(5)}
+        stats = premium_stats(codes, names, prices, weights, spots, bins=10)
+        premiums = prices / spots
+        self.assertEqual(len(stats['edges']), 11)
+        for group in stats['groups']:
+            values = premiums[codes == int(group['name'].split()[1])]
+            self.assertEqual(group['count'], len(values))
+            self.assertAlmostEqual(group['mean'], values.mean())
+            self.assertAlmostEqual(group['median'], np.median(values))
+            self.assertAlmostEqual(group['p10'], np.percentile(values, 10))
+            self.assertAlmostEqual(group['p90'], np.percentile(values, 90))
+            self.assertEqual(sum(group['histogram']), len(values))
+
+    def test_skips_invalid_premiums(self):
+        stats = premium_stats(np.array([1, 2]), None, np.array([30.0, 30.0]),
+                              np.array([1.0, 0.0]), np.array([15.0, 15.0]), bins=4)
+        self.assertEqual([group['name'] for group in stats['groups']], [1])
+        self.assertEqual(stats['groups'][0]['median'], 2.0)
+
+
+class LoadColumnsTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_path
+        db.create_all()
+        db.session.add(Coin('Eagle', 1, 1.09, 'silver', 'US'))
+        db.session.add(Coin('Maple', 1, 1, 'gold', 'Canada'))
+        db.session.commit()
+        eagle, maple = Coin.query.order_by(Coin.name).all()
+        db.session.add(Item(eagle.id, 20.0, datetime(2016, 1, 1), 'apmex', 16.0))
+        db.session.add(Item(eagle.id, 22.0, datetime(2016, 1, 2), 'jm', 16.0, sold=True,
+                            sold_price=19.0, sold_date=datetime(2016, 2, 1), sold_spot=17.0))
+        db.session.add(Item(maple.id, 1300.0, datetime(2016, 1, 3), 'apmex', 1250.0))
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        os.remove(self.db_path)
+
+    def test_buy_side_by_dealer(self):
+        codes, names, prices, weights, spots = load_columns('buy', 'purchased_from')
+        self.assertEqual(codes.dtype, np.int64)
+        self.assertEqual(sorted(names[code] for code in codes), ['apmex', 'apmex', 'jm'])
+        self.assertEqual(sorted(prices.tolist()), [20.0, 22.0, 1300.0])
+
+    def test_sell_side_only_counts_sales(self):
+        codes, names, prices, weights, spots = load_columns('sell', 'coin')
+        self.assertEqual([names[code] for code in codes], ['Eagle'])
+        self.assertEqual(prices.tolist(), [19.0])
+        self.assertEqual(spots.tolist(), [17.0])
+
+    def test_groups_by_transaction_year(self):
+        eagle = Coin.query.filter_by(name='Eagle').one()
+        db.session.add(Item(eagle.id, 18.0, datetime(2015, 6, 1), 'apmex', 15.0, sold=True,
+                            sold_price=19.0, sold_date=datetime(2017, 3, 1), sold_spot=17.0))
+        db.session.commit()
+        stats = json.loads(self.client.get('/api/premium?by=year').get_data(as_text=True))
+        counts = {group['name']: group['count'] for group in stats['groups']}
+        self.assertEqual(counts, {2015: 1, 2016: 3})
+        codes, names, prices, weights, spots = load_columns('sell', 'year')
+        self.assertEqual(sorted(codes.tolist()), [2016, 2017])
+
+    def test_endpoint_caps_bins(self):
+        response = self.client.get('/api/premium?bins={}'.format(MAX_BINS + 1))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/premium?by=metal&bins={}'.format(MAX_BINS))
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+import os
+import tempfile
+import unittest
+
+from stacktracker import app, db
+from stacktracker.archive import archive_sold, ensure_schema
+from stacktracker.models import ArchivedItem, Coin, Item
+
+
+OLD = datetime.utcnow() - timedelta(days=400)
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_path
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        os.remove(self.db_path)
+
+    def add_coin(self):
+        db.session.add(Coin('Eagle', 1, 1.09, 'silver', 'US'))
+        db.session.commit()
+        return Coin.query.first().id
+
+    def add_item(self, coin_id, sold=True):
+        item = Item(coin_id, 20.0, OLD, 'apmex', 16.0, sold=sold, sold_price=21.0,
+                    sold_date=OLD if sold else None, sold_spot=17.0 if sold else None)
+        db.session.add(item)
+        db.session.commit()
+        return item.id
+
+    def test_moves_old_sales_only(self):
+        ensure_schema()
+        coin_id = self.add_coin()
+        sold = self.add_item(coin_id)
+        in_stack = self.add_item(coin_id, sold=False)
+        self.assertEqual(archive_sold(), 1)
+        self.assertEqual([item.id for item in Item.query.all()], [in_stack])
+        self.assertEqual([item.id for item in ArchivedItem.query.all()], [sold])
+
+    def test_sales_without_a_date_age_by_purchase_date(self):
+        ensure_schema()
+        coin_id = self.add_coin()
+        old = Item(coin_id, 20.0, OLD, 'apmex', 16.0, sold=True, sold_price=21.0)
+        recent = Item(coin_id, 20.0, datetime.utcnow(), 'apmex', 16.0, sold=True, sold_price=21.0)
+        db.session.add_all([old, recent])
+        db.session.commit()
+        old_id, recent_id = old.id, recent.id
+        self.assertEqual(archive_sold(), 1)
+        self.assertEqual([item.id for item in ArchivedItem.query.all()], [old_id])
+        self.assertEqual([item.id for item in Item.query.all()], [recent_id])
+
+    def test_ids_are_not_reused_after_archiving_everything(self):
+        ensure_schema()
+        coin_id = self.add_coin()
+        ids = [self.add_item(coin_id) for _ in range(10)]
+        self.assertEqual(archive_sold(), 10)
+        self.assertEqual(Item.query.count(), 0)
+        self.assertEqual(self.add_item(coin_id), ids[-1] + 1)
+
+    def test_upgrades_table_without_autoincrement(self):
+        with db.engine.begin() as conn:
+            conn.execute('CREATE TABLE item (id INTEGER NOT NULL, year INTEGER, purchase_price FLOAT NOT NULL, '
+                         'purchase_date DATETIME NOT NULL, purchased_from VARCHAR(60) NOT NULL, '
+                         'purchase_spot FLOAT NOT NULL, sold BOOLEAN, sold_price FLOAT, sold_date DATETIME, '
+                         'sold_to VARCHAR(60), sold_spot FLOAT, shipping_charged FLOAT, shipping_cost FLOAT, '
+                         'coin_id INTEGER NOT NULL, PRIMARY KEY (id))')
+        db.create_all()
+        coin_id = self.add_coin()
+        ids = [self.add_item(coin_id) for _ in range(3)]
+        archive_sold()
+        ensure_schema()
+        self.add_item(coin_id, sold=False)
+        self.assertEqual(Item.query.one().id, ids[-1] + 1)
+        sql = db.engine.execute("SELECT sql FROM sqlite_master WHERE name = 'item'").scalar()
+        self.assertIn('AUTOINCREMENT', sql)
+        indexes = db.engine.execute("SELECT sql FROM sqlite_master WHERE name = 'ix_item_in_stack'").scalar()
+        self.assertIn('WHERE sold = 0', indexes)
+
+    def test_api_reaches_archived_items(self):
+        ensure_schema()
+        coin_id = self.add_coin()
+        item_id = self.add_item(coin_id)
+        archive_sold()
+        items = self.client.get('/api/item').get_data(as_text=True)
+        self.assertNotIn('"id": {}'.format(item_id), items)
+        items = self.client.get('/api/item?history=true').get_data(as_text=True)
+        self.assertIn('"archived": true', items)
+        items = self.client.get('/api/item?id={}'.format(item_id)).get_data(as_text=True)
+        self.assertIn('"id": {}'.format(item_id), items)
+        response = self.client.put('/api/item', data={'id': item_id, 'sold_to': 'bob'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ArchivedItem.query.get(item_id).sold_to, 'bob')
+        response = self.client.delete('/api/item', data={'id': item_id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ArchivedItem.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
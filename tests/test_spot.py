@@ -0,0 +1,169 @@
+from datetime import date, datetime, timedelta
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from stacktracker import app, db
+from stacktracker.models import Coin, Item, SpotQuote
+from stacktracker.spot import FakeSpotProvider, SpotCache, get_cache, set_provider, spot_price
+
+
+QUOTES = {'gold': 1250.0, 'silver': 17.0, 'platinum': 1000.0, 'palladium': 600.0}
+
+
+class SpotCacheTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_path
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        os.remove(self.db_path)
+
+    def test_concurrent_callers_share_one_fetch(self):
+        provider = FakeSpotProvider(QUOTES, delay=0.2)
+        cache = SpotCache(provider, ttl=60)
+        start = threading.Event()
+        results = []
+
+        def call():
+            start.wait()
+            results.append(cache.quotes())
+
+        threads = [threading.Thread(target=call) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(provider.fetches, 1)
+        self.assertEqual(results, [QUOTES] * 20)
+
+    def test_fresh_quotes_are_not_refetched(self):
+        provider = FakeSpotProvider(QUOTES)
+        cache = SpotCache(provider, ttl=60)
+        cache.quotes()
+        cache.quotes()
+        self.assertEqual(provider.fetches, 1)
+
+    def test_stale_quotes_served_during_refresh(self):
+        provider = FakeSpotProvider(QUOTES)
+        cache = SpotCache(provider, ttl=60)
+        cache.quotes()
+        cache.invalidate()
+        provider.delay = 0.2
+        provider.quotes = dict(QUOTES, gold=1300.0)
+        refresher = threading.Thread(target=cache.quotes)
+        provider.fetching.clear()
+        refresher.start()
+        self.assertTrue(provider.fetching.wait(5))
+        self.assertEqual(cache.get('gold'), 1250.0)
+        refresher.join()
+        self.assertEqual(cache.get('gold'), 1300.0)
+        self.assertEqual(provider.fetches, 2)
+
+    def test_uses_quotes_persisted_by_another_process(self):
+        SpotCache(FakeSpotProvider(QUOTES), ttl=60).quotes()
+        provider = FakeSpotProvider(dict(QUOTES, gold=1300.0))
+        cache = SpotCache(provider, ttl=60)
+        self.assertEqual(cache.quotes(), QUOTES)
+        self.assertEqual(provider.fetches, 0)
+
+    def test_falls_back_to_persisted_quotes(self):
+        SpotCache(FakeSpotProvider(QUOTES), ttl=60).quotes()
+        table = SpotQuote.__table__
+        db.engine.execute(table.update().values(updated=datetime.utcnow() - timedelta(hours=1)))
+        provider = FakeSpotProvider({}, fail=True)
+        cache = SpotCache(provider, ttl=60)
+        self.assertEqual(cache.quotes(), QUOTES)
+        # a provider that is down isn't asked again right away
+        cache.quotes()
+        self.assertEqual(provider.fetches, 1)
+
+    def test_backs_off_when_provider_is_down_and_nothing_is_stored(self):
+        provider = FakeSpotProvider({}, fail=True)
+        cache = SpotCache(provider, ttl=60)
+        for _ in range(5):
+            self.assertEqual(cache.quotes(), {})
+        self.assertEqual(provider.fetches, 1)
+
+    def test_spot_price_ignores_old_quotes(self):
+        SpotCache(FakeSpotProvider(QUOTES), ttl=60).quotes()
+        table = SpotQuote.__table__
+        db.engine.execute(table.update().values(updated=datetime.utcnow() - timedelta(days=7)))
+        set_provider(FakeSpotProvider({}, fail=True))
+        self.assertEqual(spot_price('gold'), 1250.0)
+        self.assertIsNone(spot_price('gold', max_age=3600))
+        _, updated = get_cache().snapshot()
+        self.assertTrue(datetime.utcnow() - updated > timedelta(days=6))
+
+
+class SpotApiTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.db_path
+        db.create_all()
+        db.session.add(Coin('Eagle', 1, 1.09, 'silver', 'US'))
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        os.remove(self.db_path)
+
+    def post_item(self, **kwargs):
+        data = dict(coin_name='Eagle', purchase_price=20, purchase_date=date.today().isoformat(),
+                    purchased_from='apmex', sold='')
+        data.update(kwargs)
+        return self.client.post('/api/item', data=data)
+
+    def test_spot_includes_update_time(self):
+        set_provider(FakeSpotProvider(QUOTES))
+        data = json.loads(self.client.get('/api/spot').get_data(as_text=True))
+        self.assertEqual(data['spot'], QUOTES)
+        self.assertIsNotNone(data['updated'])
+
+    def test_fills_in_current_spot(self):
+        set_provider(FakeSpotProvider(QUOTES))
+        self.assertEqual(self.post_item().status_code, 200)
+        self.assertEqual(Item.query.one().purchase_spot, 17.0)
+
+    def test_refuses_old_spot(self):
+        SpotCache(FakeSpotProvider(QUOTES), ttl=60).quotes()
+        table = SpotQuote.__table__
+        db.engine.execute(table.update().values(updated=datetime.utcnow() - timedelta(days=7)))
+        set_provider(FakeSpotProvider({}, fail=True))
+        self.assertEqual(self.post_item().status_code, 400)
+        self.assertEqual(self.post_item(purchase_spot=16.5).status_code, 200)
+
+    def test_refuses_backdated_item_without_spot(self):
+        set_provider(FakeSpotProvider(QUOTES))
+        self.assertEqual(self.post_item(purchase_date='2015-01-01').status_code, 400)
+
+    def test_unknown_coin(self):
+        set_provider(FakeSpotProvider(QUOTES))
+        response = self.post_item(coin_name='Nope')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('coin does not exist', response.get_data(as_text=True))
+
+
+class SpotCacheJitterTest(unittest.TestCase):
+    def test_ttl_is_shortened_by_up_to_jitter(self):
+        ttls = set()
+        for _ in range(50):
+            cache = SpotCache(FakeSpotProvider(QUOTES), ttl=60, jitter=0.2)
+            cache.stagger()
+            self.assertTrue(48 <= cache._ttl <= 60)
+            ttls.add(cache._ttl)
+        self.assertTrue(len(ttls) > 1)
+
+
+if __name__ == '__main__':
+    unittest.main()